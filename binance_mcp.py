@@ -1,14 +1,21 @@
-import os, time, hmac, hashlib, asyncio
-from typing import Optional, Dict, Any
-from urllib.parse import urlencode
+import os, re, time, hmac, hashlib, asyncio, logging, queue
+from logging.handlers import QueueHandler, QueueListener
+from decimal import Decimal
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Tuple, Literal, Callable, Awaitable
+from urllib.parse import quote_plus
 
 import httpx
+import orjson
 from fastapi import FastAPI, Header, HTTPException, Depends, Query
-from pydantic import BaseModel, Field, validator
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 # -------------------------
 # Config (env-driven)
 # -------------------------
+logger = logging.getLogger("binance_mcp")
+
 BINANCE_ENV       = os.getenv("BINANCE_ENV", "mainnet").lower()  # "mainnet" or "testnet"
 
 # Auto-pick REST base from ENV unless explicitly overridden
@@ -31,76 +38,88 @@ MAX_NOTIONAL_PER_ORDER  = float(os.getenv("MAX_NOTIONAL_PER_ORDER", "0"))
 MAX_QTY_PER_ORDER       = float(os.getenv("MAX_QTY_PER_ORDER", "0"))
 MAX_PRICE_DEVIATION_PCT = float(os.getenv("MAX_PRICE_DEVIATION_PCT", "0"))
 
+# Caches
+PRICE_CACHE_TTL_MS      = int(os.getenv("PRICE_CACHE_TTL_MS", "500"))  # last-price reuse for deviation checks
+EXCHANGE_INFO_TTL_S     = float(os.getenv("EXCHANGE_INFO_TTL_S", "60"))
+
+# Server time sync
+TIME_RESYNC_THRESHOLD_MS = int(os.getenv("TIME_RESYNC_THRESHOLD_MS", "200"))  # re-anchor only past this drift
+TIME_SYNC_INTERVAL_S     = float(os.getenv("TIME_SYNC_INTERVAL_S", "600"))
+TIME_SYNC_MAX_INTERVAL_S = float(os.getenv("TIME_SYNC_MAX_INTERVAL_S", "3600"))  # backoff cap while drift stays small
+
 if not AGENT_KEY:
-    print("WARNING: AGENT_KEY is empty; set it to protect /api/*")
+    logger.warning("AGENT_KEY is empty; set it to protect /api/*")
 
 # -------------------------
 # App & HTTP client
 # -------------------------
-app = FastAPI(title="Binance MCP", version="1.1.0")
-client = httpx.AsyncClient(timeout=15.0)
-time_offset_ms = 0  # Binance time - local time (ms)
+client = httpx.AsyncClient(
+    base_url=BINANCE_HTTP_BASE,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=100, keepalive_expiry=60),
+    timeout=15.0,
+)
+time_offset_ms = 0  # Binance time - local wall time (ms), as of the last re-anchor
+
+# Timestamps run off the monotonic clock from a (Binance ms, monotonic ns) anchor, so
+# system clock steps don't leak into signed requests. Until the first sync, anchor to local time.
+_anchor_server_ms = time.time_ns() // 1_000_000
+_anchor_mono_ns   = time.monotonic_ns()
+_time_synced      = False
 
 # -------------------------
 # Auth dependency
 # -------------------------
-def require_agent_key(x_agent_key: str = Header(None, convert_underscores=False)):
-    if not AGENT_KEY or x_agent_key != AGENT_KEY:
+_AGENT_KEY_B = AGENT_KEY.encode("utf-8")
+
+def require_agent_key(x_agent_key: Optional[str] = Header(None, convert_underscores=False)):
+    # Constant-time compare so the key can't be recovered byte-by-byte from response timing
+    if not AGENT_KEY or not x_agent_key or not hmac.compare_digest(x_agent_key.encode("utf-8"), _AGENT_KEY_B):
         raise HTTPException(status_code=401, detail="Unauthorized")
     return True
 
 # -------------------------
 # Models
 # -------------------------
+# Closed enumerations: checked by pydantic-core's literal validator, no Python-level call
+Side = Literal["BUY", "SELL"]
+TimeInForce = Literal["GTC", "IOC", "FOK"]
+
 class LimitOrderIn(BaseModel):
     symbol: str
-    side: str = Field(..., regex="^(BUY|SELL)$")
-    price: float
-    qty: float
-    tif: str = Field("GTC", regex="^(GTC|IOC|FOK)$")
+    side: Side
+    price: Decimal = Field(..., gt=0)
+    qty: Decimal = Field(..., gt=0)
+    tif: TimeInForce = "GTC"
     client_id: Optional[str] = None
 
-    @validator("price", "qty")
-    def pos(cls, v):
-        if v <= 0: raise ValueError("must be > 0")
-        return v
-
 class OCOOrderIn(BaseModel):
     symbol: str
-    side: str = Field(..., regex="^(BUY|SELL)$")
-    quantity: float
-    price: float
-    stop: float
-    stop_limit: float
-    tif: str = Field("GTC", regex="^(GTC|IOC|FOK)$")
+    side: Side
+    quantity: Decimal = Field(..., gt=0)
+    price: Decimal = Field(..., gt=0)
+    stop: Decimal = Field(..., gt=0)
+    stop_limit: Decimal = Field(..., gt=0)
+    tif: TimeInForce = "GTC"
     client_id: Optional[str] = None
 
-    @validator("quantity", "price", "stop", "stop_limit")
-    def pos(cls, v):
-        if v <= 0: raise ValueError("must be > 0")
-        return v
-
-    @validator("stop_limit")
-    def oco_relation(cls, v, values):
-        stop  = values.get("stop")
-        price = values.get("price")
-        side  = values.get("side")
-        if not (stop and price and side):
-            return v
-        if side == "SELL":
-            if not (price > stop and v <= stop):
+    @model_validator(mode="after")
+    def oco_relation(self):
+        if self.side == "SELL":
+            if not (self.price > self.stop and self.stop_limit <= self.stop):
                 raise ValueError("SELL OCO requires price > stop and stop_limit <= stop")
         else:  # BUY OCO (rare)
-            if not (price < stop and v >= stop):
+            if not (self.price < self.stop and self.stop_limit >= self.stop):
                 raise ValueError("BUY OCO requires price < stop and stop_limit >= stop")
-        return v
+        return self
 
 class CancelOrderIn(BaseModel):
     symbol: str
     orderId: Optional[int] = None
     clientOrderId: Optional[str] = None
 
-    @validator("symbol")
+    @field_validator("symbol", mode="after")
+    @classmethod
     def sym(cls, v):
         if not v: raise ValueError("symbol required")
         return v
@@ -108,92 +127,211 @@ class CancelOrderIn(BaseModel):
 # -------------------------
 # Binance helpers
 # -------------------------
-def _sign(params: Dict[str, Any]) -> str:
-    query = urlencode(params, doseq=True)
-    sig = hmac.new(BINANCE_API_SECRET.encode("utf-8"), query.encode("utf-8"), hashlib.sha256).hexdigest()
-    return sig
+# Credentials pre-encoded once; httpx takes bytes header values without re-encoding
+_SECRET_B: bytes = BINANCE_API_SECRET.encode("utf-8")
+_SIGNED_HEADERS = {"X-MBX-APIKEY": BINANCE_API_KEY.encode("utf-8")}  # read-only; httpx copies it per request
+
+# Keyed HMAC state (ipad/opad already absorbed); copied per request instead of re-keying.
+# hashlib.sha256 is the OpenSSL constructor, so this is an OpenSSL HMAC_CTX (SHA-NI when available).
+_HMAC_TEMPLATE = hmac.new(_SECRET_B, b"", hashlib.sha256)
+
+_is_url_safe = re.compile(r"[A-Za-z0-9_.~-]*").fullmatch
+
+def _encode_query(params: Dict[str, Any]) -> str:
+    # Signed params are flat, ASCII-keyed scalars; only quote values that need it.
+    # Output matches urlencode() for these inputs.
+    parts = []
+    for k, v in params.items():
+        v = v if isinstance(v, str) else str(v)
+        parts.append(f"{k}={v}" if _is_url_safe(v) else f"{k}={quote_plus(v)}")
+    return "&".join(parts)
+
+def _sign(params: Dict[str, Any]) -> Tuple[str, str]:
+    """Return (query, signature); the query is what gets sent, byte-for-byte."""
+    query = _encode_query(params)
+    h = _HMAC_TEMPLATE.copy()
+    h.update(query.encode("utf-8"))
+    return query, h.hexdigest()
+
+def _refresh_health():
+    # /api/health is polled hard; serialize it only when its content changes
+    global _HEALTH_BYTES
+    _HEALTH_BYTES = orjson.dumps({
+        "ok": True,
+        "env": BINANCE_ENV,
+        "base": BINANCE_HTTP_BASE,
+        "time_offset_ms": time_offset_ms
+    })
+
+_refresh_health()
 
-async def _timestamp_ms() -> int:
-    return int(time.time() * 1000) + time_offset_ms
+def _timestamp_ms() -> int:
+    return _anchor_server_ms + (time.monotonic_ns() - _anchor_mono_ns) // 1_000_000
 
-async def _sync_time():
-    global time_offset_ms
+async def _sync_time() -> bool:
+    """Measure drift against Binance; re-anchor if it exceeds the threshold. Returns True if drift was small."""
+    global time_offset_ms, _anchor_server_ms, _anchor_mono_ns, _time_synced
     try:
-        r = await client.get(f"{BINANCE_HTTP_BASE}/api/v3/time")
+        sent_ns = time.monotonic_ns()
+        r = await client.get("/api/v3/time")
         r.raise_for_status()
-        server_time = r.json()["serverTime"]
-        local = int(time.time() * 1000)
-        time_offset_ms = int(server_time) - local
-        print(f"[time-sync] env={BINANCE_ENV} base={BINANCE_HTTP_BASE} offset_ms={time_offset_ms}")
+        server_time = int(orjson.loads(r.content)["serverTime"])
+        mid_ns = (sent_ns + time.monotonic_ns()) // 2  # assume the server stamped mid-flight
+        drift = server_time - (_anchor_server_ms + (mid_ns - _anchor_mono_ns) // 1_000_000)
+        if _time_synced and abs(drift) <= TIME_RESYNC_THRESHOLD_MS:
+            return True
+        _anchor_server_ms, _anchor_mono_ns = server_time, mid_ns
+        time_offset_ms = _timestamp_ms() - time.time_ns() // 1_000_000
+        _time_synced = True
+        _refresh_health()
+        logger.info("[time-sync] env=%s base=%s offset_ms=%d drift_ms=%d",
+                    BINANCE_ENV, BINANCE_HTTP_BASE, time_offset_ms, drift)
     except Exception as e:
-        print(f"[time-sync] failed: {e}")
+        logger.warning("[time-sync] failed: %s", e)
+    return False
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fallback output only when the host hasn't configured logging for us (or the root logger).
+    # Records are queued from the event loop; stream writes happen on the listener's thread.
+    queue_handler = listener = None
+    restore_level = False
+    if not logger.hasHandlers():
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        stream = logging.StreamHandler()
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        listener = QueueListener(log_queue, stream)
+        queue_handler = QueueHandler(log_queue)
+        logger.addHandler(queue_handler)
+        if logger.level == logging.NOTSET:
+            # Otherwise root's default WARNING would drop the [time-sync] info lines
+            logger.setLevel(logging.INFO)
+            restore_level = True
+        listener.start()
 
-@app.on_event("startup")
-async def on_start():
     await _sync_time()
     async def refresher():
+        interval = TIME_SYNC_INTERVAL_S
         while True:
-            await asyncio.sleep(600)
-            await _sync_time()
-    asyncio.create_task(refresher())
+            await asyncio.sleep(interval)
+            if await _sync_time():
+                interval = min(interval * 2, TIME_SYNC_MAX_INTERVAL_S)
+            else:
+                interval = TIME_SYNC_INTERVAL_S
+    task = asyncio.create_task(refresher())
+    try:
+        yield
+    finally:
+        task.cancel()
+        await client.aclose()
+        if listener is not None:
+            logger.removeHandler(queue_handler)
+            if restore_level:
+                logger.setLevel(logging.NOTSET)
+            listener.stop()
+
+app = FastAPI(title="Binance MCP", version="1.1.0", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+async def _public_get_raw(path: str, params: Dict[str, Any] = None) -> bytes:
+    r = await client.get(path, params=params or {})
+    r.raise_for_status()
+    return r.content
 
 async def _public_get(path: str, params: Dict[str, Any] = None):
-    url = f"{BINANCE_HTTP_BASE}{path}"
-    r = await client.get(url, params=params or {})
-    r.raise_for_status()
-    return r.json()
+    return orjson.loads(await _public_get_raw(path, params))
 
 async def _signed_request(method: str, path: str, params: Dict[str, Any]):
     if not BINANCE_API_KEY or not BINANCE_API_SECRET:
         raise HTTPException(500, "BINANCE_API_KEY/BINANCE_API_SECRET not set")
 
-    params = dict(params or {})
-    params["timestamp"] = await _timestamp_ms()
-    params["recvWindow"] = RECV_WINDOW_MS
-    params["signature"] = _sign(params)
-    headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
-    url = f"{BINANCE_HTTP_BASE}{path}"
+    if method not in ("GET", "POST", "DELETE"):
+        raise HTTPException(500, f"Unsupported method {method}")
 
+    # Callers hand over a fresh dict, so it is extended in place
+    params["timestamp"] = _timestamp_ms()
+    params["recvWindow"] = RECV_WINDOW_MS
+    query, sig = _sign(params)
+    url = f"{path}?{query}&signature={sig}"
+
+    r = await client.request(method, url, headers=_SIGNED_HEADERS)
+    body = r.content
+    if r.is_success:
+        # Empty bodies (e.g. some DELETEs) skip the parser entirely
+        return orjson.loads(body) if body else {"ok": True}
     try:
-        if method == "GET":
-            r = await client.get(url, params=params, headers=headers)
-        elif method == "POST":
-            r = await client.post(url, params=params, headers=headers)
-        elif method == "DELETE":
-            r = await client.delete(url, params=params, headers=headers)
-        else:
-            raise HTTPException(500, f"Unsupported method {method}")
-        r.raise_for_status()
-        return r.json() if r.content else {"ok": True}
-    except httpx.HTTPStatusError as e:
-        try:
-            detail = e.response.json()
-        except Exception:
-            detail = {"status_code": e.response.status_code, "text": e.response.text}
-        raise HTTPException(status_code=e.response.status_code, detail=detail)
+        detail = orjson.loads(body)
+    except Exception:
+        detail = {"status_code": r.status_code, "text": r.text}
+    raise HTTPException(status_code=r.status_code, detail=detail)
+
+def _dec(v: Decimal) -> str:
+    # Plain positional notation; str() would emit "1E-7" for tiny values, which Binance rejects
+    return format(v, "f")
 
 # Guardrails
-def _enforce_limits(symbol: str, side: str, price: float, qty: float):
+def _enforce_limits(symbol: str, side: str, price: Decimal, qty: Decimal):
     notional = price * qty
     if MAX_NOTIONAL_PER_ORDER > 0 and notional > MAX_NOTIONAL_PER_ORDER:
         raise HTTPException(400, f"Notional {notional:.8f} exceeds MAX_NOTIONAL_PER_ORDER={MAX_NOTIONAL_PER_ORDER}")
     if MAX_QTY_PER_ORDER > 0 and qty > MAX_QTY_PER_ORDER:
         raise HTTPException(400, f"Quantity {qty} exceeds MAX_QTY_PER_ORDER={MAX_QTY_PER_ORDER}")
 
-async def _get_last_price(symbol: str) -> Optional[float]:
+_price_cache: Dict[str, Tuple[float, float]] = {}  # symbol -> (price, monotonic deadline)
+_price_inflight: Dict[str, "asyncio.Future[Optional[float]]"] = {}
+
+async def _fetch_last_price(symbol: str) -> Optional[float]:
     try:
         d = await _public_get("/api/v3/ticker/price", {"symbol": symbol})
-        return float(d["price"])
+        price = float(d["price"])
     except Exception:
         return None
+    _price_cache[symbol] = (price, time.monotonic() + PRICE_CACHE_TTL_MS / 1000.0)
+    return price
+
+async def _single_flight(inflight: Dict[Any, "asyncio.Future"], key: Any, fetch: Callable[[], Awaitable[Any]]):
+    """Run fetch() once per key; concurrent callers for the same key await the first caller's result.
+
+    If the caller doing the fetch is cancelled, waiting callers are not: they retry, and one of
+    them takes over the fetch.
+    """
+    while (fut := inflight.get(key)) is not None:
+        try:
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            if fut.cancelled() and not asyncio.current_task().cancelling():
+                continue
+            raise
+    fut = asyncio.get_running_loop().create_future()
+    fut.add_done_callback(lambda f: f.cancelled() or f.exception())  # no "never retrieved" warnings
+    inflight[key] = fut
+    try:
+        res = await fetch()
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    else:
+        fut.set_result(res)
+        return res
+    finally:
+        inflight.pop(key, None)
 
-async def _enforce_price_deviation(symbol: str, user_price: float):
+async def _get_last_price(symbol: str) -> Optional[float]:
+    symbol = symbol.upper()
+    hit = _price_cache.get(symbol)
+    if hit and time.monotonic() < hit[1]:
+        return hit[0]
+    return await _single_flight(_price_inflight, symbol, lambda: _fetch_last_price(symbol))
+
+async def _enforce_price_deviation(symbol: str, user_price: Decimal):
     if MAX_PRICE_DEVIATION_PCT <= 0:
         return
     last = await _get_last_price(symbol)
     if last is None:
         return
-    deviation = abs(user_price - last) / last * 100.0
+    deviation = abs(float(user_price) - last) / last * 100.0
     if deviation > MAX_PRICE_DEVIATION_PCT:
         raise HTTPException(400, f"Price deviation {deviation:.2f}% > limit {MAX_PRICE_DEVIATION_PCT}% (last={last})")
 
@@ -202,30 +340,44 @@ async def _enforce_price_deviation(symbol: str, user_price: float):
 # -------------------------
 @app.get("/api/health")
 async def health():
-    return {
-        "ok": True,
-        "env": BINANCE_ENV,
-        "base": BINANCE_HTTP_BASE,
-        "time_offset_ms": time_offset_ms
-    }
+    return Response(_HEALTH_BYTES, media_type="application/json")
+
+# exchangeInfo is large and rarely changes: keep Binance's raw JSON bytes per symbol
+_ei_cache: Dict[Optional[str], Tuple[bytes, float]] = {}  # symbol -> (body, monotonic deadline)
+_ei_inflight: Dict[Optional[str], "asyncio.Future[bytes]"] = {}
 
 @app.get("/api/exchangeInfo")
 async def exchange_info(symbol: Optional[str] = Query(None)):
-    params = {"symbol": symbol} if symbol else None
-    return await _public_get("/api/v3/exchangeInfo", params)
+    hit = _ei_cache.get(symbol)
+    if hit and time.monotonic() < hit[1]:
+        return Response(hit[0], media_type="application/json")
+    async def fetch() -> bytes:
+        params = {"symbol": symbol} if symbol else None
+        body = await _public_get_raw("/api/v3/exchangeInfo", params)
+        _ei_cache[symbol] = (body, time.monotonic() + EXCHANGE_INFO_TTL_S)
+        return body
+    body = await _single_flight(_ei_inflight, symbol, fetch)
+    return Response(body, media_type="application/json")
+
+_ZERO_AMOUNT = "0.00000000"  # how Binance renders empty balances
 
 @app.get("/api/balances", dependencies=[Depends(require_agent_key)])
 async def balances(assets: Optional[str] = Query(None, description="CSV e.g. USDT,BTC,SOL")):
     data = await _signed_request("GET", "/api/v3/account", {})
     bals = data.get("balances", [])
-    if assets:
-        wanted = {a.strip().upper() for a in assets.split(",") if a.strip()}
-        bals = [b for b in bals if b.get("asset","").upper() in wanted]
+    # Binance already reports asset codes uppercased
+    wanted = frozenset(a.strip().upper() for a in assets.split(",") if a.strip()) if assets else None
     out = []
     for b in bals:
-        free, locked = float(b["free"]), float(b["locked"])
+        asset = b["asset"]
+        if wanted is not None and asset not in wanted:
+            continue
+        free_s, locked_s = b["free"], b["locked"]
+        if free_s == _ZERO_AMOUNT and locked_s == _ZERO_AMOUNT:
+            continue
+        free, locked = float(free_s), float(locked_s)
         if free != 0 or locked != 0:
-            out.append({"asset": b["asset"], "free": free, "locked": locked, "total": free+locked})
+            out.append({"asset": asset, "free": free, "locked": locked, "total": free+locked})
     return {"balances": out}
 
 @app.get("/api/open-orders", dependencies=[Depends(require_agent_key)])
@@ -235,18 +387,21 @@ async def open_orders(symbol: Optional[str] = Query(None)):
 
 class LimitOrderBody(LimitOrderIn): pass
 
+# Fixed fields merged into every outgoing order
+_LIMIT_TEMPLATE = {"type": "LIMIT", "newOrderRespType": "RESULT"}
+_OCO_TEMPLATE   = {"newOrderRespType": "RESULT"}
+
 @app.post("/api/order/limit", dependencies=[Depends(require_agent_key)])
 async def place_limit(order: LimitOrderBody):
     _enforce_limits(order.symbol, order.side, order.price, order.qty)
     await _enforce_price_deviation(order.symbol, order.price)
     params = {
+        **_LIMIT_TEMPLATE,
         "symbol": order.symbol.upper(),
         "side": order.side,
-        "type": "LIMIT",
         "timeInForce": order.tif,
-        "quantity": f"{order.qty}",
-        "price": f"{order.price}",
-        "newOrderRespType": "RESULT",
+        "quantity": _dec(order.qty),
+        "price": _dec(order.price),
     }
     if order.client_id:
         params["newClientOrderId"] = order.client_id
@@ -260,14 +415,14 @@ async def place_oco(oco: OCOBody):
     _enforce_limits(oco.symbol, oco.side, oco.price, oco.quantity)
     await _enforce_price_deviation(oco.symbol, oco.price)
     params = {
+        **_OCO_TEMPLATE,
         "symbol": oco.symbol.upper(),
         "side": oco.side,
-        "quantity": f"{oco.quantity}",
-        "price": f"{oco.price}",
-        "stopPrice": f"{oco.stop}",
-        "stopLimitPrice": f"{oco.stop_limit}",
+        "quantity": _dec(oco.quantity),
+        "price": _dec(oco.price),
+        "stopPrice": _dec(oco.stop),
+        "stopLimitPrice": _dec(oco.stop_limit),
         "stopLimitTimeInForce": oco.tif,
-        "newOrderRespType": "RESULT",
     }
     if oco.client_id:
         params["listClientOrderId"] = oco.client_id